@@ -13,46 +13,55 @@ from sys import stdout
 from loguru import logger
 
 
+# 各日志级别的颜色配置 => Colors of each log level
+COLOR_CONFIG_DICT = {
+    'trace': {
+        'time': '#70acde',
+        'level': '#cfe2f3'
+    },
+    'info': {
+        'time': '#70acde',
+        'level': '#9cbfdd'
+    },
+    'debug': {
+        'time': '#70acde',
+        'level': '#8598ea'
+    },
+    'warning': {
+        'time': '#70acde',
+        'level': '#dcad5a'
+    },
+    'success': {
+        'time': '#70acde',
+        'level': '#3dd08d'
+    },
+    'error': {
+        'time': '#70acde',
+        'level': '#ae2c2c'
+    },
+    'default': {
+        'time': '#70acde',
+        'level': '#b3cfe7'
+    }
+}
+
+# 导入时预先生成各日志级别的格式字符串 => Format strings of each log level, built once at import time
+LOG_FORMATS = {
+    level: f"<fg {color['time']}>{{time:MM-DD-YYYY HH:mm:ss}}</fg {color['time']}> | "
+           f"<fg {color['level']}>{{level}}</fg {color['level']}>: <light-white>{{message}}</light-white>\n"
+    for level, color in COLOR_CONFIG_DICT.items()
+}
+
+# 不带颜色标签的日志格式，输出不是终端时使用 => Format without color tags, used when output is not a TTY
+PLAIN_LOG_FORMAT = "{time:MM-DD-YYYY HH:mm:ss} | {level}: {message}"
+
+
 def log_formatter(record: dict) -> str:
     """
     格式化每条日志记录 => Formatter for log records
     :param dict record: 日志记录 => Log object containing log metadata & message.
     """
-    color_config_dict = {
-        'trace': {
-            'time': '#70acde',
-            'level': '#cfe2f3'
-        },
-        'info': {
-            'time': '#70acde',
-            'level': '#9cbfdd'
-        },
-        'debug': {
-            'time': '#70acde',
-            'level': '#8598ea'
-        },
-        'warning': {
-            'time': '#70acde',
-            'level': '#dcad5a'
-        },
-        'success': {
-            'time': '#70acde',
-            'level': '#3dd08d'
-        },
-        'error': {
-            'time': '#70acde',
-            'level': '#ae2c2c'
-        },
-        'default': {
-            'time': '#70acde',
-            'level': '#b3cfe7'
-        }
-    }
-
-    level = record["level"].name.lower()
-    time_color = color_config_dict.get(level, 'default').get('time')
-    level_color = color_config_dict.get(level, 'default').get('level')
-    return f"<fg {time_color}>{{time:MM-DD-YYYY HH:mm:ss}}</fg {time_color}> | <fg {level_color}>{{level}}</fg {level_color}>: <light-white>{{message}}</light-white>\n"
+    return LOG_FORMATS.get(record["level"].name.lower(), LOG_FORMATS['default'])
 
 
 def get_logger() -> logger:
@@ -60,7 +69,11 @@ def get_logger() -> logger:
     实例化日志类 => Create custom logger.
     """
     logger.remove()
-    logger.add(stdout, colorize=True, format=log_formatter)
+    if stdout.isatty():
+        logger.add(stdout, colorize=True, format=log_formatter)
+    else:
+        # 输出重定向到文件或管道时不需要颜色，使用固定格式字符串，由loguru在添加时预先解析
+        logger.add(stdout, colorize=False, format=PLAIN_LOG_FORMAT)
     return logger
 
 
@@ -8,15 +8,76 @@
   Created : 2022/6/27
 -------------------------------------------------
 """
+import atexit
 import os
+import posixpath
+import select
+import queue
+import shlex
+import socket
 import stat
-from typing import List, Optional, Tuple, NoReturn
+import tarfile
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Generator, Iterable, Iterator, List, Optional, Tuple, NoReturn, Union
 
-from paramiko import SSHClient, AutoAddPolicy, MissingHostKeyPolicy
+from paramiko import Channel, SSHClient, SFTPClient, SFTPAttributes, SFTPFile, AutoAddPolicy, MissingHostKeyPolicy
 from paramiko.ssh_exception import AuthenticationException, SSHException
 
 from custom_logger import logger
 
+# 分块传输时每次读写的块大小（1MiB）
+TRANSFER_BLOCK_SIZE = 1 << 20
+# ssh通道默认窗口大小（128MiB），paramiko默认仅为2MiB，高延迟链路下带宽无法跑满
+DEFAULT_WINDOW_SIZE = (1 << 27) - 1
+# ssh通道默认最大数据包大小（512KiB）
+DEFAULT_MAX_PACKET_SIZE = 1 << 19
+# tcp套接字收发缓冲区大小（32MiB）
+SOCKET_BUFFER_SIZE = 32 << 20
+# 文件夹内文件数不少于该值时，使用tar打包流传输代替逐个文件传输
+BULK_TRANSFER_MIN_FILES = 4
+# 统计远程文件数的命令超时时间（秒），超时或失败时不使用tar打包传输
+BULK_PROBE_TIMEOUT = 10
+# 常驻shell中执行命令时等待输出的超时时间（秒），超时后关闭shell，避免不完整的命令一直阻塞
+SHELL_COMMAND_TIMEOUT = 300
+# 逐个传输文件夹内文件时的默认并发数，每个线程使用独立的sftp会话
+DEFAULT_TRANSFER_WORKERS = 8
+# 主sftp会话和常驻shell之外，文件并发传输和大文件切分下载共用的额外sftp会话上限
+# OpenSSH默认MaxSessions为10，超出后打开通道会失败
+MAX_EXTRA_SFTP_SESSIONS = 8
+# 不小于该大小（64MiB）的文件按字节区间切分后并发下载
+LARGE_FILE_SIZE = 64 << 20
+# 大文件切分的区间数
+LARGE_FILE_PARTS = 4
+# 批量创建远程文件夹时单条命令的最大长度（100KiB），超出后拆分为多条命令
+MKDIR_BATCH_MAX_LENGTH = 100 << 10
+# sftp单个读写请求的默认大小（32KiB）及允许范围
+DEFAULT_SFTP_CHUNK_SIZE = 32768
+MIN_SFTP_CHUNK_SIZE = 4096
+MAX_SFTP_CHUNK_SIZE = 65536
+# 创建远程文件夹的命令模板，导入时绑定format方法，参数为已转义的路径（可为多个，以空格分隔）
+_MKDIR_TMPL = 'mkdir -p {}'.format
+# 连接池中每个主机和用户保留的最大空闲连接数
+POOL_MAX_IDLE = 8
+
+# ssh连接池，按(主机, 端口, 用户名, 密码)保存已认证的空闲连接，避免重复握手和认证
+_POOL: Dict[tuple, List[SSHClient]] = defaultdict(list)
+_POOL_LOCK = threading.Lock()
+
+
+def _close_pool() -> NoReturn:
+    """关闭连接池中所有空闲连接"""
+    with _POOL_LOCK:
+        clients = [client for idle in _POOL.values() for client in idle]
+        _POOL.clear()
+    for client in clients:
+        client.close()
+
+
+atexit.register(_close_pool)
+
 
 class RemoteClient:
     """
@@ -24,46 +85,180 @@ class RemoteClient:
     功能：
     :func command: 执行单条命令
     :func execute_commands: 执行命令列表，可执行多条命令
+    :func execute_commands_parallel: 并发执行多条相互独立的命令
+    :func shell_command: 在常驻的远程shell中执行单条命令
     :func write_file: 写入内容都远程文件
     :func get_file: 获取远程文件或者文件夹到本地
     :func put_file: 上传本地文件或者文件夹到远程
     """
-    def __init__(self, hostname, username, password, port=22):
+    def __init__(self, hostname, username, password, port=22,
+                 window_size=DEFAULT_WINDOW_SIZE, max_packet_size=DEFAULT_MAX_PACKET_SIZE,
+                 transfer_workers=DEFAULT_TRANSFER_WORKERS, use_pool=True,
+                 sftp_chunk_size=DEFAULT_SFTP_CHUNK_SIZE):
         """
         构造函数初始化
         :param hostname: 主机ip
         :param username: 用户名
         :param password: 密码
         :param port: 端口，默认端口22
+        :param window_size: ssh通道窗口大小，默认128MiB
+        :param max_packet_size: ssh通道最大数据包大小，默认512KiB
+        :param transfer_workers: 文件夹内文件并发传输数，默认8
+        :param use_pool: 是否复用连接池中的空闲连接，断开时将连接归还连接池，默认是
+        :param sftp_chunk_size: sftp单个读写请求的大小，范围4096~65536，默认32768，
+                                为None时在首次下载时按服务端实际返回的数据块大小自动设置
         """
         self.hostname = hostname
         self.port = port
         self.username = username
         self.password = password
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.transfer_workers = transfer_workers
+        # 额外sftp会话的名额，文件并发传输和大文件切分下载共用，保证同时打开的会话总数有上限
+        self._session_slots = threading.BoundedSemaphore(MAX_EXTRA_SFTP_SESSIONS)
+        self.use_pool = use_pool
+        if sftp_chunk_size is not None:
+            sftp_chunk_size = min(max(sftp_chunk_size, MIN_SFTP_CHUNK_SIZE), MAX_SFTP_CHUNK_SIZE)
+        self.sftp_chunk_size = sftp_chunk_size
         self.client = None
+        self.transport = None
         self.sftp = None
+        # 常驻的远程shell通道，多条命令复用同一个通道执行
+        self._shell: Optional[Channel] = None
+        self._shell_lock = threading.Lock()
+
+    def _create_socket(self, timeout: float) -> socket.socket:
+        """
+        创建到远程主机的tcp连接，关闭Nagle算法并调大收发缓冲区
+        :param timeout: 连接超时时间
+        :return:
+        """
+        # 与paramiko一致，依次尝试解析出的每个地址，全部失败时抛出最后一个错误
+        error = None
+        for family, sock_type, proto, _, address in socket.getaddrinfo(self.hostname, self.port, 0, socket.SOCK_STREAM):
+            sock = socket.socket(family, sock_type, proto)
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                # 缓冲区需要在connect之前设置，才能参与tcp窗口扩大因子的协商
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+                sock.settimeout(timeout)
+                sock.connect(address)
+                return sock
+            except OSError as e:
+                sock.close()
+                error = e
+        raise error
+
+    @property
+    def _pool_key(self) -> tuple:
+        """连接池键"""
+        return self.hostname, self.port, self.username, self.password
+
+    def _acquire_pooled_client(self) -> Optional[SSHClient]:
+        """
+        从连接池中取出一个可用的空闲连接
+        :return: 没有可用连接时返回None
+        """
+        while True:
+            with _POOL_LOCK:
+                idle = _POOL.get(self._pool_key)
+                if not idle:
+                    return None
+                client = idle.pop()
+
+            transport = client.get_transport()
+            if transport is not None and transport.is_active():
+                try:
+                    # 发送ignore消息确认连接仍然可用
+                    transport.send_ignore()
+                    return client
+                except Exception:
+                    pass
+            client.close()
+
+    def _release_pooled_client(self, client: SSHClient) -> bool:
+        """
+        将连接归还连接池
+        :param client: 要归还的连接
+        :return: 连接池已满或连接已失效时返回False
+        """
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+
+        with _POOL_LOCK:
+            idle = _POOL[self._pool_key]
+            if len(idle) >= POOL_MAX_IDLE:
+                return False
+            idle.append(client)
+            return True
 
     def connect(self) -> NoReturn:
-        """建立ssh连接"""
+        """建立ssh连接，启用连接池时优先复用空闲连接"""
         try:
-            self.client = SSHClient()
-            self.client.load_system_host_keys()
-            self.client.set_missing_host_key_policy(AutoAddPolicy())
-            # self.client.set_missing_host_key_policy(MissingHostKeyPolicy())
-            self.client.connect(hostname=self.hostname, port=self.port, username=self.username, password=self.password, timeout=5000)
-            self.sftp = self.client.open_sftp()
+            self.client = self._acquire_pooled_client() if self.use_pool else None
+            if self.client is None:
+                self.client = SSHClient()
+                self.client.load_system_host_keys()
+                self.client.set_missing_host_key_policy(AutoAddPolicy())
+                # self.client.set_missing_host_key_policy(MissingHostKeyPolicy())
+                sock = self._create_socket(timeout=5000)
+                self.client.connect(hostname=self.hostname, port=self.port, username=self.username, password=self.password, timeout=5000, sock=sock)
+            # 调大后续打开通道的窗口和数据包大小，使服务端可以连续发送数据而不必等待窗口调整
+            self.transport = self.client.get_transport()
+            self.transport.default_window_size = self.window_size
+            self.transport.default_max_packet_size = self.max_packet_size
+            self.sftp = self._open_sftp()
         except AuthenticationException as e:
             logger.error(f"AuthenticationException occurred; did you remember to generate an SSH key? {e}")
         except Exception as e:
             logger.error(f"Unexpected error occurred while connecting to host: {e}")
 
+    def _open_sftp(self) -> SFTPClient:
+        """在已建立的ssh连接上打开一个新的sftp会话"""
+        return SFTPClient.from_transport(self.transport, window_size=self.window_size,
+                                         max_packet_size=self.max_packet_size)
+
+    def _open_extra_sftp(self, blocking: bool = True) -> Optional[SFTPClient]:
+        """
+        占用一个额外会话名额并打开sftp会话，使用完后需调用_close_extra_sftp归还名额
+        :param blocking: 名额已满时是否等待
+        :return: 不等待且名额已满，或服务端拒绝打开新会话（如MaxSessions较小）时返回None，调用方改用已打开的会话
+        """
+        if not self._session_slots.acquire(blocking):
+            return None
+        try:
+            return self._open_sftp()
+        except (SSHException, OSError) as e:
+            self._session_slots.release()
+            logger.warning(f"警告：打开新的sftp会话失败，改用已打开的会话传输：{e!r}")
+            return None
+
+    def _close_extra_sftp(self, sftp: SFTPClient) -> NoReturn:
+        """关闭额外的sftp会话并归还名额"""
+        try:
+            sftp.close()
+        finally:
+            self._session_slots.release()
+
     def disconnect(self) -> NoReturn:
-        """关闭ssh连接"""
+        """关闭ssh连接，启用连接池时将连接归还连接池"""
         if self.sftp:
             self.sftp.close()
+            self.sftp = None
+
+        if self._shell:
+            self._shell.close()
+            self._shell = None
 
         if self.client:
-            self.client.close()
+            if not (self.use_pool and self._release_pooled_client(self.client)):
+                # 关闭client时会一并关闭transport和底层套接字
+                self.client.close()
+            self.client = None
+            self.transport = None
 
     def __enter__(self):
         """上下文管理器进入函数"""
@@ -74,15 +269,118 @@ class RemoteClient:
         """上下文管理器退出函数"""
         self.disconnect()
 
-    def command(self, command: str) -> Tuple[List[str], bool]:
+    def command(self, command: str, stream: bool = False) -> Union[Tuple[List[str], bool], Generator[str, None, bool]]:
         """
         执行shell命令
         :param command: 要执行的shell命令语句
+        :param stream: 是否以生成器逐行返回标准输出，输出较大时不必等待命令结束，也不必整体保存在内存中，
+                       生成器结束时的返回值为命令是否执行成功
         :return:
         """
+        if stream:
+            return self._stream_command(command)
+
+        stdin, stdout, stderr = self.client.exec_command(command)
+        # 先读完输出再获取退出码，输出较大时远程进程需要输出被读取后才能退出
+        out_data, err_data = self._drain_channel(stdout.channel)
+        is_success = stdout.channel.recv_exit_status() == 0
+        response = (out_data if is_success else err_data).decode('utf-8', 'ignore').splitlines()
+        if is_success:
+            logger.info(f"\nINPUT: {command}\nOUTPUT: {response}")
+        else:
+            logger.error(f"\nINPUT: {command}\nOUTPUT: {response}")
+
+        return response, is_success
+
+    @staticmethod
+    def _drain_channel(channel: Channel) -> Tuple[bytes, bytes]:
+        """
+        同时读取通道的标准输出和标准错误直到结束
+        任一输出未被读取而占满通道窗口时远程进程都会阻塞，依次读取两者在输出较大时会互相等待
+        :param channel: 执行命令的通道
+        :return: 标准输出和标准错误的内容
+        """
+        out_data, err_data = bytearray(), bytearray()
+        while True:
+            if channel.recv_ready():
+                out_data += channel.recv(TRANSFER_BLOCK_SIZE)
+            elif channel.recv_stderr_ready():
+                err_data += channel.recv_stderr(TRANSFER_BLOCK_SIZE)
+            elif channel.eof_received or channel.closed:
+                return bytes(out_data), bytes(err_data)
+            else:
+                # 等待任一输出有新数据或通道结束
+                select.select([channel], [], [])
+
+    def _stream_command(self, command: str) -> Generator[str, None, bool]:
+        """
+        执行shell命令，逐行产出标准输出
+        :param command: 要执行的shell命令语句
+        :return: 命令是否执行成功
+        """
         stdin, stdout, stderr = self.client.exec_command(command)
-        info, is_success = (stdout, True) if stdout.channel.recv_exit_status() == 0 else (stderr, False)
-        response = info.read().decode('utf-8', 'ignore').strip().split('\n')
+        for line in stdout.channel.makefile('rb'):
+            yield line.decode('utf-8', 'ignore').rstrip('\r\n')
+
+        is_success = stdout.channel.recv_exit_status() == 0
+        if is_success:
+            logger.info(f"\nINPUT: {command}\nOUTPUT: <stream>")
+        else:
+            logger.error(f"\nINPUT: {command}\nOUTPUT: {stderr.read().decode('utf-8', 'ignore').splitlines()}")
+
+        return is_success
+
+    def _open_shell(self) -> Channel:
+        """获取常驻的远程shell通道，不存在或已关闭时新建，不分配伪终端，输出中不会回显输入"""
+        if self._shell is None or self._shell.closed:
+            self._shell = self.transport.open_session()
+            self._shell.invoke_shell()
+        return self._shell
+
+    def shell_command(self, command: str, timeout: Optional[float] = SHELL_COMMAND_TIMEOUT) -> Tuple[List[str], bool]:
+        """
+        在常驻的远程shell中执行shell命令，省去每条命令打开通道和获取退出码的往返
+        注意：命令之间共享shell状态（如cd、export），命令不能读取标准输入，也不能执行exit
+             命令必须完整，引号和heredoc需要闭合，不能以&&、||、|或\\结尾，否则shell会一直等待后续输入直到超时
+        :param command: 要执行的shell命令语句
+        :param timeout: 等待输出的超时时间（秒），超时后关闭shell，下次调用时重新打开，默认300，为None时不超时
+        :return:
+        """
+        # 以随机标记分隔每条命令的输出，标记行后跟命令的退出码
+        marker = f"__END_{uuid.uuid4().hex}__"
+        with self._shell_lock:
+            shell = self._open_shell()
+            shell.settimeout(timeout)
+            shell.sendall(f"{command}\nprintf '\\n{marker}%d\\n' $?\nprintf '\\n{marker}\\n' >&2\n".encode('utf-8'))
+            stdout, stderr = shell.makefile('rb'), shell.makefile_stderr('rb')
+
+            exit_status, out_lines, err_lines = None, [], []
+            try:
+                for line in stdout:
+                    line = line.decode('utf-8', 'ignore')
+                    if line.startswith(marker):
+                        exit_status = int(line[len(marker):].strip())
+                        break
+                    out_lines.append(line)
+
+                for line in stderr:
+                    line = line.decode('utf-8', 'ignore')
+                    if line.startswith(marker):
+                        break
+                    err_lines.append(line)
+            except socket.timeout:
+                # shell可能仍在等待命令的后续输入，无法继续复用，关闭后下次调用重新打开
+                shell.close()
+                self._shell = None
+                raise SSHException(f"远程shell执行命令{command}超时，命令可能不完整或在等待标准输入")
+
+            if exit_status is None:
+                self._shell = None
+                raise SSHException(f"远程shell在执行命令{command}时意外关闭")
+
+        is_success = exit_status == 0
+        # 去掉标记行前额外输出的换行符
+        response = ''.join(out_lines if is_success else err_lines)[:-1].splitlines()
         if is_success:
             logger.info(f"\nINPUT: {command}\nOUTPUT: {response}")
         else:
@@ -90,28 +388,228 @@ class RemoteClient:
 
         return response, is_success
 
-    def execute_commands(self, commands: List[str]) -> List[Tuple[List[str], bool]]:
+    def execute_commands(self, commands: List[str], multiplex: bool = False) -> List[Tuple[List[str], bool]]:
         """
         Execute multiple commands in succession.
 
         :param List[str] commands: List of unix commands as strings.
+        :param bool multiplex: Run all commands in one persistent remote shell, see `shell_command`.
         """
+        if multiplex:
+            return [self.shell_command(cmd) for cmd in commands]
 
         return [self.command(cmd) for cmd in commands]
 
-    def write_file(self, text: str, remote_file_path: str) -> NoReturn:
+    def execute_commands_parallel(self, commands: List[str], max_workers: int = 8) -> List[Tuple[List[str], bool]]:
+        """
+        并发执行多条命令，每条命令在同一连接上单独打开一个通道
+        注意：命令之间必须相互独立，不能依赖前一条命令的shell状态（如cd、export）
+        :param commands: 要执行的shell命令列表
+        :param max_workers: 最大并发数，默认8
+        :return: 按提交顺序返回每条命令的执行结果
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.command, commands))
+
+    def write_file(self, text: Union[str, bytes, bytearray, memoryview], remote_file_path: str) -> NoReturn:
         """
         远程写可执行文件，并保持在远程主机上
-        :param text: 写入内容
+        :param text: 写入内容，字符串按utf-8编码，bytes类数据直接写入
         :param remote_file_path: 写入的远程文件路径
         :return:
         """
-        if self.is_remote_exist(remote_file_path) and self.is_remote_dir(remote_file_path):
+        attr = self._try_stat(remote_file_path)
+        if attr is not None and stat.S_ISDIR(attr.st_mode):
             logger.error(f"错误：远程路径{remote_file_path}已经存在，并且为文件夹，无法正常写入")
             raise ValueError(f"错误：远程路径{remote_file_path}已经存在，并且为文件夹，无法正常写入")
 
-        self.sftp.open(remote_file_path, 'w').write(text)
-        self.sftp.chmod(remote_file_path, 755)
+        # 字符串只编码一次，之后以memoryview切片分块写入，不再复制数据
+        data = text if isinstance(text, (bytes, bytearray, memoryview)) else text.encode('utf-8')
+        view = memoryview(data).cast('B')
+        with self.sftp.open(remote_file_path, 'wb') as f:
+            self._set_chunk_size(f)
+            # 开启流水线写入，不必每个数据包都等待服务端确认
+            f.set_pipelined(True)
+            for offset in range(0, len(view), TRANSFER_BLOCK_SIZE):
+                f.write(view[offset:offset + TRANSFER_BLOCK_SIZE])
+        # 流水线写入的错误响应在关闭时会被丢弃，通过远程文件大小确认数据已全部写入
+        self._check_remote_size(self.sftp, remote_file_path, len(view))
+        self.sftp.chmod(remote_file_path, 0o755)
+
+    @staticmethod
+    def _check_remote_size(sftp: SFTPClient, remote_path: str, size: int) -> NoReturn:
+        """
+        检查写入后的远程文件大小是否与预期一致
+        :param sftp: 使用的sftp会话
+        :param remote_path: 远程文件路径
+        :param size: 预期的文件大小
+        """
+        remote_size = sftp.stat(remote_path).st_size
+        if remote_size != size:
+            raise IOError(f"错误：远程文件{remote_path}大小为{remote_size}，与写入大小{size}不一致")
+
+    def _set_chunk_size(self, f: SFTPFile, size: int = 0) -> NoReturn:
+        """
+        设置远程文件句柄单个读写请求的大小，未指定大小时以该文件探测服务端实际返回的数据块大小
+        部分服务端返回的数据块小于请求大小，请求过大会导致预取失效，传输速度大幅下降
+        :param f: 远程文件句柄
+        :param size: 远程文件大小，仅读取时需要
+        """
+        if self.sftp_chunk_size is None and size >= MAX_SFTP_CHUNK_SIZE:
+            # 发送单个最大读请求，服务端返回的数据长度即为其实际支持的数据块大小
+            f.MAX_REQUEST_SIZE = MAX_SFTP_CHUNK_SIZE
+            observed = len(f._read(MAX_SFTP_CHUNK_SIZE) or b'')
+            self.sftp_chunk_size = min(max(observed, MIN_SFTP_CHUNK_SIZE), MAX_SFTP_CHUNK_SIZE)
+            logger.info(f'sftp单个读写请求大小设置为：{self.sftp_chunk_size}')
+        f.MAX_REQUEST_SIZE = self.sftp_chunk_size or DEFAULT_SFTP_CHUNK_SIZE
+
+    def _run_transfers(self, transfer: Callable, tasks: Iterable[tuple]) -> NoReturn:
+        """
+        并发执行文件传输任务，每个线程从会话池取出独立的sftp会话使用，会话在需要时才打开
+        任务可以是生成器，每产出一个任务即提交执行，不必等待全部任务收集完成
+        :param transfer: 传输函数，调用方式为transfer(sftp, *task)
+        :param tasks: 传输任务
+        """
+        # 先打开一个额外会话，无法打开时与单线程一样在主会话上逐个传输
+        first = self._open_extra_sftp() if self.transfer_workers > 1 else None
+        if first is None:
+            # 主会话上执行传输前先收集全部任务，避免与生成器中尚未完成的列目录请求交错
+            for task in list(tasks):
+                transfer(self.sftp, *task)
+            return
+
+        sessions = queue.Queue()
+        sessions.put(first)
+        opened = [first]
+
+        def run(task):
+            try:
+                sftp = sessions.get_nowait()
+            except queue.Empty:
+                sftp = self._open_extra_sftp()
+                if sftp is None:
+                    # 无法打开新会话时等待已打开的会话空闲后复用，至少已有一个会话，不会一直等待
+                    sftp = sessions.get()
+                else:
+                    opened.append(sftp)
+            try:
+                transfer(sftp, *task)
+            finally:
+                sessions.put(sftp)
+
+        # 每个线程最多占用一个名额，线程数不超过名额数，等待名额的线程只需等待大文件切分下载临时占用的名额归还
+        workers = min(self.transfer_workers, MAX_EXTRA_SFTP_SESSIONS)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(run, task) for task in tasks]
+                for future in futures:
+                    future.result()
+        finally:
+            for sftp in opened:
+                self._close_extra_sftp(sftp)
+
+    def _download_in_parts(self, sftp: SFTPClient, remote_path: str, local_path: str, size: int) -> NoReturn:
+        """
+        将大文件按字节区间切分，在当前会话和空闲名额打开的额外会话上并发下载
+        额外会话不等待名额，名额已被占满时在当前会话上依次下载各区间
+        :param sftp: 当前使用的sftp会话
+        :param remote_path: 远程文件路径
+        :param local_path: 本地文件路径
+        :param size: 文件大小
+        """
+        with open(local_path, 'wb') as f:
+            f.truncate(size)
+
+        part_size = -(-size // LARGE_FILE_PARTS)
+        extra = []
+        sessions = queue.Queue()
+        sessions.put(sftp)
+
+        def fetch(offset):
+            end = min(offset + part_size, size)
+            sftp = sessions.get()
+            try:
+                with sftp.open(remote_path, 'rb') as src, open(local_path, 'r+b') as dst:
+                    self._set_chunk_size(src, size)
+                    src.seek(offset)
+                    # 预取当前区间的数据，请求不再逐个等待响应
+                    src.prefetch(end)
+                    dst.seek(offset)
+                    remaining = end - offset
+                    while remaining > 0:
+                        chunk = src.read(min(TRANSFER_BLOCK_SIZE, remaining))
+                        if not chunk:
+                            raise IOError(f"错误：远程文件{remote_path}在偏移{end - remaining}处提前结束")
+                        dst.write(chunk)
+                        remaining -= len(chunk)
+            finally:
+                sessions.put(sftp)
+
+        try:
+            for _ in range(LARGE_FILE_PARTS - 1):
+                extra_sftp = self._open_extra_sftp(blocking=False)
+                if extra_sftp is None:
+                    break
+                extra.append(extra_sftp)
+                sessions.put(extra_sftp)
+
+            with ThreadPoolExecutor(max_workers=len(extra) + 1) as executor:
+                list(executor.map(fetch, range(0, size, part_size)))
+        finally:
+            for extra_sftp in extra:
+                self._close_extra_sftp(extra_sftp)
+
+    def _download(self, sftp: SFTPClient, remote_path: str, local_path: str, size: int) -> NoReturn:
+        """
+        下载远程文件到本地文件，不做路径检查
+        :param sftp: 使用的sftp会话
+        :param remote_path: 远程文件路径
+        :param local_path: 本地文件路径
+        :param size: 远程文件大小
+        """
+        if size >= LARGE_FILE_SIZE:
+            self._download_in_parts(sftp, remote_path, local_path, size)
+        else:
+            with sftp.open(remote_path, 'rb') as src, open(local_path, 'wb') as dst:
+                self._set_chunk_size(src, size)
+                src.prefetch(size)
+                while True:
+                    chunk = src.read(TRANSFER_BLOCK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+        logger.info(f'接收：远程路径：{remote_path} -> 本地路径：{local_path}')
+
+    def _upload(self, sftp: SFTPClient, local_path: str, remote_path: str) -> NoReturn:
+        """
+        上传本地文件到远程文件，分块流水线写入，不做路径检查
+        :param sftp: 使用的sftp会话
+        :param local_path: 本地文件路径
+        :param remote_path: 远程文件路径
+        """
+        with open(local_path, 'rb') as src, sftp.file(remote_path, 'wb') as dst:
+            self._set_chunk_size(dst)
+            dst.set_pipelined(True)
+            size = 0
+            # 复用同一块缓冲区读取本地文件，不必每块都分配新的bytes
+            buffer = bytearray(TRANSFER_BLOCK_SIZE)
+            view = memoryview(buffer)
+            while True:
+                length = src.readinto(buffer)
+                if not length:
+                    break
+                dst.write(view[:length])
+                size += length
+        self._check_remote_size(sftp, remote_path, size)
+        logger.info(f'发送：本地路径：{local_path} -> 远程路径：{remote_path}')
+
+    def _ensure_local_dir(self, path: str) -> NoReturn:
+        """
+        确保本地文件夹存在
+        :param path: 本地文件夹路径
+        """
+        if path:
+            os.makedirs(path, exist_ok=True)
 
     def _get_one_file(self, remote_path: str, local_path: str) -> NoReturn:
         """
@@ -119,56 +617,162 @@ class RemoteClient:
         :param remote_path: 远程单个文件路径
         :param local_path: 本地文件或者文件夹路径
         """
-        if not self.is_remote_exist(remote_path):
+        attr = self._try_stat(remote_path)
+        if attr is None:
             # 如果远程路径不存在，提示错误
             logger.error(f"错误：远程路径{remote_path}不存在")
             raise ValueError(f"错误：远程路径{local_path}不存在")
 
-        if not os.path.exists(os.path.dirname(local_path)):
-            # 如果本地路径父级文件夹不存在
-            if local_path.endswith('/'):
-                # 如果本地路径以'/'结尾，则创建文件夹
-                os.makedirs(local_path, exist_ok=True)
-            else:
-                # 否则创建本地路径父级文件夹
-                os.makedirs(os.path.dirname(local_path))
+        # 如果本地路径以'/'结尾，则创建文件夹，否则创建本地路径父级文件夹
+        self._ensure_local_dir(local_path if local_path.endswith('/') else os.path.dirname(local_path))
 
         if os.path.isdir(local_path):
             # 如果本地路径是文件夹，则拼接新的文件路径
-            local_path = os.path.join(local_path, os.path.split(remote_path)[-1]).replace('\\', '/')
+            local_path = os.path.join(local_path, posixpath.basename(remote_path)).replace('\\', '/')
 
         # 最终获取文件，是从远程文件下载到本地文件
-        self.sftp.get(remote_path, local_path)
-        logger.info(f'接收：远程路径：{remote_path} -> 本地路径：{local_path}')
+        self._download(self.sftp, remote_path, local_path, attr.st_size)
 
-    def get_file(self, remote_path: str, local_path: str) -> NoReturn:
+    def _count_remote_files(self, remote_dir: str, limit: int) -> int:
+        """
+        统计远程文件夹下的文件数，最多统计到limit个
+        仅允许sftp的账号（如ForceCommand internal-sftp）无法正常执行命令，任何失败都返回0，改为逐个文件传输
+        :param remote_dir: 远程文件夹路径
+        :param limit: 统计上限
+        :return:
+        """
+        channel = None
+        try:
+            stdin, stdout, stderr = self.client.exec_command(f"find {shlex.quote(remote_dir)} -type f | head -n {limit} | wc -l",
+                                                             timeout=BULK_PROBE_TIMEOUT)
+            channel = stdout.channel
+            # 关闭标准输入，避免被强制替换的命令一直等待输入
+            channel.shutdown_write()
+            output = stdout.read()
+            if channel.recv_exit_status() != 0:
+                return 0
+            return int(output.decode('utf-8', 'ignore').strip() or 0)
+        except Exception as e:
+            logger.warning(f"警告：统计远程路径{remote_dir}文件数失败，改为逐个文件传输：{e!r}")
+            return 0
+        finally:
+            if channel is not None:
+                channel.close()
+
+    def _bulk_get_via_tar(self, remote_dir: str, local_dir: str) -> bool:
+        """
+        在远程将文件夹打包为tar流，本地边接收边解包，整个文件夹只需一次传输
+        与sftp逐个传输一致，符号链接会被跟随，传输的是链接指向的内容
+        :param remote_dir: 远程文件夹路径
+        :param local_dir: 本地文件夹路径
+        :return: 是否传输成功
+        """
+        # h选项跟随符号链接打包
+        stdin, stdout, stderr = self.client.exec_command(f"tar chf - -C {shlex.quote(remote_dir)} .")
+        try:
+            stdin.channel.shutdown_write()
+            with tarfile.open(fileobj=stdout, mode='r|', bufsize=TRANSFER_BLOCK_SIZE) as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    # 拒绝解包到目标文件夹之外的路径
+                    tar.extractall(local_dir, filter='data')
+                else:
+                    tar.extractall(local_dir)
+
+            # GNU tar遇到失效的链接或打包期间变化的文件时返回1，其余文件已完整传输，与sftp逐个传输跳过失效链接一致
+            exit_status = stdout.channel.recv_exit_status()
+            if exit_status == 1:
+                logger.warning(f"警告：tar打包接收远程路径{remote_dir}时跳过部分文件：{stderr.read().decode('utf-8', 'ignore').strip()}")
+            elif exit_status != 0:
+                logger.warning(f"警告：tar打包接收远程路径{remote_dir}失败：{stderr.read().decode('utf-8', 'ignore').strip()}")
+                return False
+        except (tarfile.TarError, OSError, SSHException) as e:
+            logger.warning(f"警告：tar打包接收远程路径{remote_dir}失败：{e}")
+            return False
+        finally:
+            # 任何情况下都关闭通道，避免远程tar阻塞，连接归还连接池后通道仍然占用
+            stdout.channel.close()
+
+        logger.info(f'接收：远程路径：{remote_dir} -> 本地路径：{local_dir}（tar打包）')
+        return True
+
+    def _walk_remote_dir(self, remote_dir: str, local_dir: str) -> Iterator[tuple]:
+        """
+        遍历远程文件夹，创建对应的本地文件夹，边列目录边产出待下载的文件
+        :param remote_dir: 远程文件夹路径
+        :param local_dir: 本地文件夹路径
+        :return: 下载任务，元素为(远程文件路径, 本地文件路径, 文件大小)
+        """
+        def file_task(sub_remote_path, name, attr):
+            sub_local_path = os.path.join(local_dir, name).replace('\\', '/')
+            if os.path.isdir(sub_local_path):
+                sub_local_path = os.path.join(sub_local_path, name).replace('\\', '/')
+            return sub_remote_path, sub_local_path, attr.st_size
+
+        # listdir_iter边接收边产出目录项，文件在列目录的同时即可开始下载，直接使用目录项属性，不再单独stat
+        # 列目录期间不能在主会话上发起其他请求，子文件夹和链接在列完当前文件夹后再处理
+        sub_dirs, links = [], []
+        for attr in self.sftp.listdir_iter(remote_dir):
+            sub_remote_path = posixpath.join(remote_dir, attr.filename)
+            if stat.S_ISLNK(attr.st_mode):
+                links.append((sub_remote_path, attr.filename))
+                continue
+
+            if stat.S_ISDIR(attr.st_mode):
+                sub_dirs.append((sub_remote_path, attr.filename))
+            elif stat.S_ISREG(attr.st_mode):
+                yield file_task(sub_remote_path, attr.filename, attr)
+
+        for sub_remote_path, name in links:
+            # listdir_iter返回的是链接本身的属性，需要stat获取链接指向的属性
+            attr = self._try_stat(sub_remote_path)
+            if attr is None:
+                continue
+            if stat.S_ISDIR(attr.st_mode):
+                sub_dirs.append((sub_remote_path, name))
+            elif stat.S_ISREG(attr.st_mode):
+                yield file_task(sub_remote_path, name, attr)
+
+        for sub_remote_path, name in sub_dirs:
+            sub_local_path = os.path.join(local_dir, name).replace('\\', '/')
+            try:
+                self._ensure_local_dir(sub_local_path)
+            except FileExistsError:
+                logger.error(f"错误：本地路径{sub_local_path}为文件，但远程路径{sub_remote_path}为文件夹，无法传输")
+                raise ValueError(f"错误：本地路径{sub_local_path}为文件，但远程路径{sub_remote_path}为文件夹，无法传输")
+            yield from self._walk_remote_dir(sub_remote_path, sub_local_path)
+
+    def get_file(self, remote_path: str, local_path: str, bulk: bool = True) -> NoReturn:
         """
         从远程获取（文件或者文件夹）到本地
         :param remote_path: 远程路径
         :param local_path: 本地路径
+        :param bulk: 文件夹内文件较多时是否使用tar打包传输，默认是
         """
-        if not self.is_remote_exist(remote_path):
+        attr = self._try_stat(remote_path)
+        if attr is None:
             logger.error(f"错误：远程路径{remote_path}不存在")
             raise ValueError(f"错误：远程路径{remote_path}不存在")
 
-        if self.is_remote_dir(remote_path):
+        if stat.S_ISDIR(attr.st_mode):
             # 如果远程路径是文件夹
             if not os.path.exists(local_path):
                 # 如果本地路径不存在，创建本地路径为文件夹，否则本地路径可能为文件或者文件夹
                 os.makedirs(local_path, exist_ok=True)
 
             if os.path.isdir(local_path):
-                # 如果远程路径是文件夹
-                for item in self.sftp.listdir(remote_path):
-                    sub_remote_path = os.path.join(remote_path, item).replace('\\', '/')
-                    sub_local_path = os.path.join(local_path, item).replace('\\', '/')
-                    self.get_file(sub_remote_path, sub_local_path)
+                # 如果远程路径是文件夹，文件较多时整体打包传输，失败或文件较少时逐个传输
+                if bulk and self._count_remote_files(remote_path, BULK_TRANSFER_MIN_FILES) >= BULK_TRANSFER_MIN_FILES:
+                    if self._bulk_get_via_tar(remote_path, local_path):
+                        return
+
+                # 边遍历边并发下载
+                self._run_transfers(self._download, self._walk_remote_dir(remote_path, local_path))
             else:
                 # 如果本地路径是文件，提示错误，远程文件夹无法传输到本地文件
                 logger.error(f"错误：本地路径{local_path}为文件，但远程路径{remote_path}为文件夹，无法传输")
                 raise ValueError(f"错误：本地路径{local_path}为文件，但远程路径{remote_path}为文件夹，无法传输")
 
-        elif self.is_remote_file(remote_path):
+        elif stat.S_ISREG(attr.st_mode):
             # 如果远程路径是文件
             self._get_one_file(remote_path, local_path)
 
@@ -183,28 +787,121 @@ class RemoteClient:
             logger.error(f"错误：本地路径{local_path}不存在")
             raise ValueError(f"错误：本地路径{local_path}不存在")
 
-        if not self.is_remote_exist(os.path.dirname(remote_path)):
+        # 远程路径存在时其父级文件夹必然存在，不必再判断父级文件夹
+        attr = self._try_stat(remote_path)
+        if attr is None and self._try_stat(posixpath.dirname(remote_path)) is None:
             # 如果远程路径父级文件夹不存在
             if remote_path.endswith('/'):
                 # 如果远程路径以'/'结尾，则创建文件夹
                 self.remote_makedir(remote_path)
+                attr = self._try_stat(remote_path)
             else:
                 # 否则创建远程路径父级文件夹
-                self.remote_makedir(os.path.dirname(remote_path))
+                self.remote_makedir(posixpath.dirname(remote_path))
 
-        if self.is_remote_dir(remote_path):
+        if attr is not None and stat.S_ISDIR(attr.st_mode):
             # 如果远程路径是文件夹，则拼接新的文件路径
-            remote_path = os.path.join(remote_path, os.path.split(local_path)[-1]).replace('\\', '/')
+            remote_path = posixpath.join(remote_path, os.path.basename(local_path))
 
         # 最终上传文件，是从本地文件上传到远程文件
-        self.sftp.put(local_path, remote_path)
-        logger.info(f'发送：本地路径：{local_path} -> 远程路径：{remote_path}')
+        self._upload(self.sftp, local_path, remote_path)
+
+    @staticmethod
+    def _count_local_files(local_dir: str, limit: int) -> int:
+        """
+        统计本地文件夹下的文件数，最多统计到limit个
+        :param local_dir: 本地文件夹路径
+        :param limit: 统计上限
+        :return:
+        """
+        count = 0
+        for _, _, files in os.walk(local_dir):
+            count += len(files)
+            if count >= limit:
+                return limit
+        return count
 
-    def put_file(self, local_path: str, remote_path: str) -> NoReturn:
+    def _bulk_put_via_tar(self, local_dir: str, remote_dir: str) -> bool:
+        """
+        在本地将文件夹打包为tar流，远程边接收边解包，整个文件夹只需一次传输
+        :param local_dir: 本地文件夹路径
+        :param remote_dir: 远程文件夹路径
+        :return: 是否传输成功
+        """
+        quoted_dir = shlex.quote(remote_dir)
+        # 不保留归档中的属主和权限，与sftp上传一致，文件属于登录用户并按远程umask设置权限
+        stdin, stdout, stderr = self.client.exec_command(
+            f"mkdir -p {quoted_dir} && tar xf - --no-same-owner --no-same-permissions -C {quoted_dir}")
+        try:
+            # 与sftp逐个上传一致，跟随符号链接打包链接指向的内容
+            # 逐个添加子项，归档中不含'.'，远程tar不会改写目标文件夹本身的权限和修改时间
+            with tarfile.open(fileobj=stdin, mode='w|', bufsize=TRANSFER_BLOCK_SIZE, dereference=True) as tar:
+                for root, dir_names, file_names in os.walk(local_dir, followlinks=True):
+                    for name in dir_names + file_names:
+                        path = os.path.join(root, name)
+                        if not os.path.exists(path):
+                            # 跳过失效的符号链接，与sftp逐个上传一致
+                            continue
+                        tar.add(path, arcname=os.path.relpath(path, local_dir), recursive=False)
+            # 发送EOF，让远程tar结束解包
+            stdin.channel.shutdown_write()
+
+            if stdout.channel.recv_exit_status() != 0:
+                logger.warning(f"警告：tar打包发送本地路径{local_dir}失败：{stderr.read().decode('utf-8', 'ignore').strip()}")
+                return False
+        except (tarfile.TarError, OSError, SSHException) as e:
+            logger.warning(f"警告：tar打包发送本地路径{local_dir}失败：{e}")
+            return False
+        finally:
+            stdout.channel.close()
+
+        logger.info(f'发送：本地路径：{local_dir} -> 远程路径：{remote_dir}（tar打包）')
+        return True
+
+    def _list_remote_dir(self, remote_dir: str) -> Dict[str, SFTPAttributes]:
+        """
+        列出远程文件夹的目录项属性
+        :param remote_dir: 远程文件夹路径
+        :return: 文件名到属性的映射，远程文件夹不存在时返回空字典
+        """
+        try:
+            return {attr.filename: attr for attr in self.sftp.listdir_attr(remote_dir)}
+        except IOError:
+            return {}
+
+    def _walk_local_dir(self, local_dir: str, remote_dir: str, dirs: List[str], tasks: List[tuple],
+                        remote_exists: bool = True) -> NoReturn:
+        """
+        遍历本地文件夹，收集需要创建的远程文件夹和待上传的文件
+        :param local_dir: 本地文件夹路径
+        :param remote_dir: 远程文件夹路径
+        :param dirs: 收集的远程文件夹列表
+        :param tasks: 收集的上传任务列表，元素为(本地文件路径, 远程文件路径)
+        :param remote_exists: 远程文件夹是否已存在，不存在时其下不会有同名文件夹，不必列目录
+        """
+        # 每个已存在的远程文件夹只列一次目录，不必逐个文件stat判断远程是否为同名文件夹
+        remote_attrs = self._list_remote_dir(remote_dir) if remote_exists else {}
+        for item in os.listdir(local_dir):
+            sub_local_path = os.path.join(local_dir, item).replace('\\', '/')
+            sub_remote_path = posixpath.join(remote_dir, item)
+            attr = remote_attrs.get(item)
+            if os.path.isdir(sub_local_path):
+                dirs.append(sub_remote_path)
+                self._walk_local_dir(sub_local_path, sub_remote_path, dirs, tasks, attr is not None)
+            elif os.path.isfile(sub_local_path):
+                if attr is not None and stat.S_ISLNK(attr.st_mode):
+                    # 目录项属性是链接本身的属性，需要stat获取链接指向的属性
+                    attr = self._try_stat(sub_remote_path)
+                if attr is not None and stat.S_ISDIR(attr.st_mode):
+                    sub_remote_path = posixpath.join(sub_remote_path, item)
+                tasks.append((sub_local_path, sub_remote_path))
+
+    def put_file(self, local_path: str, remote_path: str, bulk: bool = True) -> NoReturn:
         """
         从本地上传文件或者文件夹到远程
         :param local_path: 本地路径
         :param remote_path: 远程路径
+        :param bulk: 文件夹内文件较多时是否使用tar打包传输，默认是
         """
         if not os.path.exists(local_path):
             logger.error(f"错误：本地路径{local_path}不存在")
@@ -212,16 +909,25 @@ class RemoteClient:
 
         if os.path.isdir(local_path):
             # 如果本地路径是文件夹
-            if not self.is_remote_exist(remote_path):
+            attr = self._try_stat(remote_path)
+            if attr is None:
                 # 如果远程路径不存在，创建远程路径为文件夹，否则远程路径可能为文件或者文件夹
                 self.remote_makedir(remote_path)
+                attr = self._try_stat(remote_path)
+
+            if attr is not None and stat.S_ISDIR(attr.st_mode):
+                # 如果远程路径是文件夹，文件较多时整体打包传输，失败或文件较少时逐个传输
+                if bulk and self._count_local_files(local_path, BULK_TRANSFER_MIN_FILES) >= BULK_TRANSFER_MIN_FILES:
+                    if self._bulk_put_via_tar(local_path, remote_path):
+                        return
 
-            if self.is_remote_dir(remote_path):
-                # 如果远程路径是文件夹
-                for item in os.listdir(local_path):
-                    sub_local_path = os.path.join(local_path, item).replace('\\', '/')
-                    sub_remote_path = os.path.join(remote_path, item).replace('\\', '/')
-                    self.put_file(sub_local_path, sub_remote_path)
+                # 先遍历收集所有文件夹和文件，一次性创建远程文件夹后再并发上传
+                dirs, tasks = [], []
+                self._walk_local_dir(local_path, remote_path, dirs, tasks)
+                if not self.remote_makedirs(dirs):
+                    logger.error(f"错误：在远程路径{remote_path}下创建文件夹失败，无法传输")
+                    raise ValueError(f"错误：在远程路径{remote_path}下创建文件夹失败，无法传输")
+                self._run_transfers(self._upload, tasks)
             else:
                 # 如果远程路径是文件，提示错误，本地文件夹无法传输到远程文件
                 logger.error(f"错误：远程路径{remote_path}为文件，但本地路径{local_path}为文件夹，无法传输")
@@ -230,42 +936,61 @@ class RemoteClient:
             # 如果本地路径是文件
             self._put_one_file(local_path, remote_path)
 
+    def _try_stat(self, path: str) -> Optional[SFTPAttributes]:
+        """
+        获取远程路径属性
+        需要同时判断存在性和类型时，调用一次后直接检查st_mode，避免多次请求
+        :param path: 远程路径
+        :return: 远程路径不存在时返回None
+        """
+        try:
+            return self.sftp.stat(path)
+        except FileNotFoundError:
+            return None
+
     def is_remote_exist(self, path: str) -> bool:
         """
         判断远程路径是否存在
         :param path: 要判断的路径
         :return:
         """
-        try:
-            self.sftp.stat(path)
-            return True
-        except FileNotFoundError:
-            return False
+        return self._try_stat(path) is not None
 
     def is_remote_dir(self, path: str) -> bool:
         """判断远程是否为文件夹"""
-        try:
-            return stat.S_ISDIR(self.sftp.stat(path).st_mode)
-        except FileNotFoundError:
-            return False
-        except Exception:
-            return False
+        attr = self._try_stat(path)
+        return attr is not None and stat.S_ISDIR(attr.st_mode)
 
     def is_remote_file(self, path: str) -> bool:
         """判断远程是否为文件"""
-        try:
-            return stat.S_ISREG(self.sftp.stat(path).st_mode)
-        except FileNotFoundError:
-            return False
-        except Exception:
-            return False
+        attr = self._try_stat(path)
+        return attr is not None and stat.S_ISREG(attr.st_mode)
 
     def remote_makedir(self, path: str) -> bool:
         """
         在远程创建文件夹
         :param path: 要创建的路径
         """
-        _, is_success = self.command(f"mkdir -p {path}")
+        _, is_success = self.command(_MKDIR_TMPL(shlex.quote(path)))
+        return is_success
+
+    def remote_makedirs(self, paths: List[str]) -> bool:
+        """
+        在远程批量创建文件夹，合并为尽量少的mkdir -p命令
+        :param paths: 要创建的路径列表
+        """
+        is_success = True
+        batch, length = [], 0
+        for path in paths:
+            quoted_path = shlex.quote(path)
+            if batch and length + len(quoted_path) + 1 > MKDIR_BATCH_MAX_LENGTH:
+                is_success = self.command(_MKDIR_TMPL(' '.join(batch)))[1] and is_success
+                batch, length = [], 0
+            batch.append(quoted_path)
+            length += len(quoted_path) + 1
+
+        if batch:
+            is_success = self.command(_MKDIR_TMPL(' '.join(batch)))[1] and is_success
         return is_success
 
     def remote_mkdir_p(self, path: str) -> Optional[bool]:
@@ -283,7 +1008,7 @@ class RemoteClient:
         try:
             self.sftp.chdir(path)
         except IOError:
-            dirname, basename = os.path.split(path.rstrip('/'))
+            dirname, basename = posixpath.split(path.rstrip('/'))
             self.remote_mkdir_p(dirname)
             self.sftp.mkdir(basename)
             self.sftp.chdir(basename)